@@ -0,0 +1,309 @@
+# ***** BEGIN LICENSE BLOCK *****
+# Version: MPL 1.1/GPL 2.0/LGPL 2.1
+#
+# The contents of this file are subject to the Mozilla Public License Version
+# 1.1 (the "License"); you may not use this file except in compliance with
+# the License. You may obtain a copy of the License at
+# http://www.mozilla.org/MPL/
+#
+# Software distributed under the License is distributed on an "AS IS" basis,
+# WITHOUT WARRANTY OF ANY KIND, either express or implied. See the License
+# for the specific language governing rights and limitations under the
+# License.
+#
+# The Original Code is Mozilla Build Watch.
+#
+# The Initial Developer of the Original Code is
+#   Dave Townsend <dtownsend@oxymoronical.com>
+#
+# Portions created by the Initial Developer are Copyright (C) 2009
+# the Initial Developer. All Rights Reserved.
+#
+# Contributor(s):
+#
+# Alternatively, the contents of this file may be used under the terms of
+# either the GNU General Public License Version 2 or later (the "GPL"), or
+# the GNU Lesser General Public License Version 2.1 or later (the "LGPL"),
+# in which case the provisions of the GPL or the LGPL are applicable instead
+# of those above. If you wish to allow use of your version of this file only
+# under the terms of either the GPL or the LGPL, and not to allow others to
+# use your version of this file under the terms of the MPL, indicate your
+# decision by deleting the provisions above and replace them with the notice
+# and other provisions required by the GPL or the LGPL. If you do not delete
+# the provisions above, a recipient may use your version of this file under
+# the terms of any one of the MPL, the GPL or the LGPL.
+#
+# ***** END LICENSE BLOCK *****
+#
+# Records the signals sent during a build into a compact archive that can be
+# replayed into any Output later without the original log.
+#
+# The archive is a header (magic, version, start time in milliseconds)
+# followed by one record per signal: an opcode, the milliseconds and log lines
+# since the previous record and then the signal's arguments. All numbers are
+# unsigned varints. Strings are interned, the first use writes a 0 followed
+# by the length and the utf-8 text, later uses write the string's index + 1.
+# Directories are written as their position in the current tier's list. Log
+# lines are only kept when they are needed to show an error.
+
+from datetime import datetime
+from util import to_bytes, from_bytes, timestamp
+
+MAGIC = b"BWAR"
+VERSION = 1
+
+# The number of log lines shown before an error
+CONTEXT = 5
+
+# Arguments: s is an interned string, d a list of directories, p a directory
+# in the current list and l a raw log line.
+SIGNALS = [
+  ("start_prebuild", ""),
+  ("start_configure", "s"),
+  ("finish_configure", "s"),
+  ("start_tier", "sd"),
+  ("start_exports", "p"),
+  ("start_export_subdir", "p"),
+  ("finish_exports", "p"),
+  ("start_libs", "p"),
+  ("start_libs_subdir", "p"),
+  ("finish_libs", "p"),
+  ("start_tools", "sd"),
+  ("start_tools_dir", "p"),
+  ("start_tools_subdir", "p"),
+  ("finish_tools_dir", "p"),
+  ("error", ""),
+  ("build_log", "l"),
+  ("destroy", ""),
+]
+
+OPCODES = dict([(SIGNALS[i][0], i) for i in range(len(SIGNALS))])
+
+def _write_varint(buffer, value):
+  while value > 0x7f:
+    buffer.append((value & 0x7f) | 0x80)
+    value >>= 7
+  buffer.append(value)
+
+def _millis(date):
+  return int(round(timestamp(date) * 1000))
+
+# The ArchiveOutput receives signals during the build process and records
+# them to an archive file.
+class ArchiveOutput:
+  fp = None
+  clock = None
+  linecount = None
+  last = 0
+  lines = 0
+  lastline = 0
+  strings = None
+  dirs = None
+  context = None
+  failed = False
+
+  def __init__(self, path, clock = datetime.now, linecount = None):
+    self.fp = open(path, "wb")
+    self.clock = clock
+    self.linecount = linecount
+    self.strings = dict()
+    self.context = []
+    self.last = _millis(self.clock())
+    header = bytearray(MAGIC)
+    header.append(VERSION)
+    _write_varint(header, self.last)
+    self.fp.write(header)
+
+  def _record(self, name, *args):
+    now = _millis(self.clock())
+    lines = self.lines
+    if self.linecount:
+      lines = self.linecount()
+    record = bytearray()
+    record.append(OPCODES[name])
+    _write_varint(record, max(now - self.last, 0))
+    _write_varint(record, lines - self.lastline)
+    self.last = max(now, self.last)
+    self.lastline = lines
+
+    for kind, arg in zip(SIGNALS[OPCODES[name]][1], args):
+      if kind == "s":
+        self._write_string(record, arg)
+      elif kind == "d":
+        _write_varint(record, len(arg))
+        for dir in arg:
+          self._write_string(record, dir)
+      elif kind == "p":
+        _write_varint(record, self.dirs.index(arg))
+      elif kind == "l":
+        data = to_bytes(arg)
+        _write_varint(record, len(data))
+        record += data
+    self.fp.write(record)
+
+  def _write_string(self, record, text):
+    if text in self.strings:
+      _write_varint(record, self.strings[text] + 1)
+    else:
+      self.strings[text] = len(self.strings)
+      data = to_bytes(text)
+      record.append(0)
+      _write_varint(record, len(data))
+      record += data
+
+  def destroy(self):
+    self._record("destroy")
+    self.fp.close()
+
+  def start_prebuild(self):
+    self._record("start_prebuild")
+
+  def start_configure(self, name):
+    self._record("start_configure", name)
+
+  def finish_configure(self, name):
+    self._record("finish_configure", name)
+
+  def start_tier(self, name, dirs):
+    self.dirs = dirs
+    self._record("start_tier", name, dirs)
+
+  def start_exports(self, dir):
+    self._record("start_exports", dir)
+
+  def start_export_subdir(self, dir):
+    self._record("start_export_subdir", dir)
+
+  def finish_exports(self, dir):
+    self._record("finish_exports", dir)
+
+  def start_libs(self, dir):
+    self._record("start_libs", dir)
+
+  def start_libs_subdir(self, dir):
+    self._record("start_libs_subdir", dir)
+
+  def finish_libs(self, dir):
+    self._record("finish_libs", dir)
+
+  def start_tools(self, name, dirs):
+    self.dirs = dirs
+    self._record("start_tools", name, dirs)
+
+  def start_tools_dir(self, dir):
+    self._record("start_tools_dir", dir)
+
+  def start_tools_subdir(self, dir):
+    self._record("start_tools_subdir", dir)
+
+  def finish_tools_dir(self, dir):
+    self._record("finish_tools_dir", dir)
+
+  def error(self):
+    if self.failed:
+      return
+    self.failed = True
+    # Keep the lines leading up to the error
+    for line in self.context:
+      self._record("build_log", line)
+    self.context = None
+    self._record("error")
+
+  def build_log(self, line):
+    self.lines += 1
+    if self.failed:
+      self._record("build_log", line)
+    else:
+      if len(self.context) == CONTEXT:
+        self.context.pop(0)
+      self.context.append(line)
+
+# The ArchiveReader reads an archive and replays its signals into an Output.
+class ArchiveReader:
+  data = None
+  offset = 0
+  start = None
+  time = None
+  lines = 0
+
+  def __init__(self, fp):
+    self.data = bytearray(fp.read())
+    if self.data[:len(MAGIC) + 1] != bytearray(MAGIC) + bytearray([VERSION]):
+      raise ValueError("Not a build archive")
+    self.offset = len(MAGIC) + 1
+    try:
+      self.start = self._read_varint() / 1000.0
+    except IndexError:
+      raise ValueError("Not a build archive")
+    self.time = self.start
+
+  def _read_varint(self):
+    value = 0
+    shift = 0
+    while True:
+      byte = self.data[self.offset]
+      self.offset += 1
+      value |= (byte & 0x7f) << shift
+      if byte < 0x80:
+        return value
+      shift += 7
+
+  def _read_bytes(self):
+    length = self._read_varint()
+    if self.offset + length > len(self.data):
+      raise IndexError()
+    data = self.data[self.offset:self.offset + length]
+    self.offset += length
+    return from_bytes(data)
+
+  def _read_string(self, strings):
+    index = self._read_varint()
+    if index > 0:
+      return strings[index - 1]
+    text = self._read_bytes()
+    strings.append(text)
+    return text
+
+  # Returns the time of the current signal, usable as an Output's clock
+  def now(self):
+    return datetime.fromtimestamp(self.time)
+
+  # Returns the number of log lines read before the current signal
+  def line_count(self):
+    return self.lines
+
+  # Yields each signal in the archive as a name and list of arguments. An
+  # archive cut short by an interrupted build simply ends early.
+  def signals(self):
+    strings = []
+    dirs = None
+    while self.offset < len(self.data):
+      try:
+        name, kinds = SIGNALS[self.data[self.offset]]
+        self.offset += 1
+        self.time += self._read_varint() / 1000.0
+        self.lines += self._read_varint()
+        args = []
+        for kind in kinds:
+          if kind == "s":
+            args.append(self._read_string(strings))
+          elif kind == "d":
+            dirs = [self._read_string(strings) for i in range(self._read_varint())]
+            args.append(dirs)
+          elif kind == "p":
+            args.append(dirs[self._read_varint()])
+          elif kind == "l":
+            args.append(self._read_bytes())
+      except IndexError:
+        return
+      yield name, args
+
+  def replay(self, output):
+    destroyed = False
+    for name, args in self.signals():
+      getattr(output, name)(*args)
+      if name == "destroy":
+        destroyed = True
+    if not destroyed:
+      output.error()
+      output.destroy()
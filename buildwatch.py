@@ -44,8 +44,17 @@
 #     OSX requires mk_add_options MOZ_MAKE_FLAGS="-w"
 # - When building:
 #     make -f client.mk 2>&1 build | tee <logfile> | python /path/to/buildwatch.py
+# - Publishing the build state for shell prompts (read it with status.py):
+#     make -f client.mk 2>&1 build | python /path/to/buildwatch.py -s <statusfile>
+# - Keeping a compact archive of the build instead of the full log:
+#     make -f client.mk 2>&1 build | python /path/to/buildwatch.py -a <archive>
+# - Redisplaying or summarising an archived build:
+#     python /path/to/buildwatch.py -r <archive> [--summary]
 #
 # Version history:
+# - 1.2.0   (unreleased)
+#     Optionally publish the build state to a memory mapped status file
+#     Optionally archive builds and replay or summarise them from the archive
 # - 1.1.0   Nov 22 2009
 #     Support windows and pymake
 # - 1.0.1   Nov 22 2009
@@ -57,7 +66,11 @@
 
 import os, sys, re, time
 from datetime import datetime
+from optparse import OptionParser
 from console import Console
+from util import format_duration
+from status import StatusOutput
+from archive import ArchiveOutput, ArchiveReader
 
 # The Output receives signals during the build process so it can update its
 # display.
@@ -67,6 +80,7 @@ class ConsoleOutput:
   COMPLETE = 2
 
   start = None
+  clock = None
   fp = None
   console = None
   pos = 0
@@ -79,30 +93,29 @@ class ConsoleOutput:
   throbber = ['-', '\\', '|', '/']
   throbpos = 0
 
-  def __init__(self, fp):
+  def __init__(self, fp, clock = datetime.now):
     self.console = Console(fp)
     self.fp = fp
+    self.clock = clock
     # Reset the display
     self.console.clear_title()
     self.console.reset_color()
     self.console.clear()
     # Clear the screen and go to the top left
-    self.start = datetime.now()
+    self.start = self.clock()
     self.fp.write("Build started at %s\n" % self.start.strftime("%H:%M:%S"))
     self.console.go_right(79)
 
   def destroy(self):
-    now = datetime.now()
-    delta = (now - self.start).seconds
-    delta, seconds = divmod(delta, 60)
-    hours, minutes = divmod(delta, 60)
+    now = self.clock()
+    duration = format_duration((now - self.start).seconds)
     if not self.failed:
       self._go_to_end();
       self.console.clear_title()
       self.console.reset_color();
-      self.fp.write("\nBuild completed at %s taking %d:%02d:%02d\n\n" % (now.strftime("%H:%M:%S"), hours, minutes, seconds))
+      self.fp.write("\nBuild completed at %s taking %s\n\n" % (now.strftime("%H:%M:%S"), duration))
     else:
-      self.fp.write("\nBuild failed at %s taking %d:%02d:%02d\n\n" % (now.strftime("%H:%M:%S"), hours, minutes, seconds))
+      self.fp.write("\nBuild failed at %s taking %s\n\n" % (now.strftime("%H:%M:%S"), duration))
 
   def _go_to_pos(self, pos):
     self._clear_throbber()
@@ -284,6 +297,125 @@ class ConsoleOutput:
         self.lines.pop(0)
       self.lines.append(line)
 
+# The SummaryOutput receives signals during the build process and prints a
+# short summary of the build once it is done.
+class SummaryOutput:
+  start = None
+  clock = None
+  fp = None
+  configures = 0
+  tiers = None
+  tier = None
+  failed = False
+  lines = None
+  linecount = None
+  loglines = 0
+
+  def __init__(self, fp, clock = datetime.now, linecount = None):
+    self.fp = fp
+    self.clock = clock
+    self.linecount = linecount
+    self.tiers = []
+    self.lines = []
+    self.start = self.clock()
+
+  def _start_tier(self, name, dirs, exports):
+    self._finish_tier()
+    self.tier = { "name": name, "dirs": len(dirs), "exports": exports, "done": set(), "start": self.clock() }
+    self.tiers.append(self.tier)
+
+  def _finish_tier(self):
+    if self.tier and "end" not in self.tier:
+      self.tier["end"] = self.clock()
+
+  def destroy(self):
+    now = self.clock()
+    if self.linecount:
+      self.loglines = self.linecount()
+    self._finish_tier()
+    self.fp.write("Build started at %s\n" % self.start.strftime("%Y-%m-%d %H:%M:%S"))
+    if self.configures > 0:
+      self.fp.write("  prebuild - %s configure scripts\n" % self.configures)
+    for tier in self.tiers:
+      self.fp.write("  %-24s" % tier["name"])
+      if tier["exports"] is not None:
+        self.fp.write(" export %s/%s  libs %s/%s" % (len(tier["exports"]), tier["dirs"], len(tier["done"]), tier["dirs"]))
+      else:
+        self.fp.write(" %s/%s dirs" % (len(tier["done"]), tier["dirs"]))
+      self.fp.write(" in %s\n" % format_duration((tier["end"] - tier["start"]).seconds))
+    self.fp.write("  %s log lines\n" % self.loglines)
+    if not self.failed:
+      self.fp.write("Build completed at %s taking %s\n" % (now.strftime("%H:%M:%S"), format_duration((now - self.start).seconds)))
+    else:
+      self.fp.write("Build failed at %s taking %s\n" % (now.strftime("%H:%M:%S"), format_duration((now - self.start).seconds)))
+      for line in self.lines:
+        self.fp.write("  %s" % line)
+
+  def start_prebuild(self):
+    pass
+
+  def start_configure(self, name):
+    self.configures += 1
+
+  def finish_configure(self, name):
+    pass
+
+  def start_tier(self, name, dirs):
+    self._start_tier("tier %s" % name, dirs, set())
+
+  def start_exports(self, dir):
+    pass
+
+  def start_export_subdir(self, dir):
+    pass
+
+  def finish_exports(self, dir):
+    self.tier["exports"].add(dir)
+
+  def start_libs(self, dir):
+    pass
+
+  def start_libs_subdir(self, dir):
+    pass
+
+  def finish_libs(self, dir):
+    self.tier["done"].add(dir)
+
+  def start_tools(self, name, dirs):
+    self._start_tier("tools tier %s" % name, dirs, None)
+
+  def start_tools_dir(self, dir):
+    pass
+
+  def start_tools_subdir(self, dir):
+    pass
+
+  def finish_tools_dir(self, dir):
+    self.tier["done"].add(dir)
+
+  def error(self):
+    self.failed = True
+
+  def build_log(self, line):
+    self.loglines += 1
+    if not self.failed:
+      if len(self.lines) == 5:
+        self.lines.pop(0)
+      self.lines.append(line)
+
+# The MultiOutput passes the signals it receives on to a number of Outputs.
+class MultiOutput:
+  outputs = None
+
+  def __init__(self, outputs):
+    self.outputs = outputs
+
+  def __getattr__(self, name):
+    def signal(*args):
+      for output in self.outputs:
+        getattr(output, name)(*args)
+    return signal
+
 # The LogParser parses a log file and sends signals to an Output
 class LogParser:
   output = None
@@ -342,17 +474,18 @@ class LogParser:
     self.output.start_tier(tier, dirs)
     line = fp.readline()
     while line != "":
-      self.output.build_log(line)
-      if self.errorreg.search(line):
-        return self.error(fp)
-      if self.donereg.search(line):
-        self.complete = True
+      # The next tier's line is logged when the caller parses it
       if self.tierreg.search(line):
         finish_last()
         return line
       if self.toolsreg.search(line):
         finish_last()
         return line
+      self.output.build_log(line)
+      if self.errorreg.search(line):
+        return self.error(fp)
+      if self.donereg.search(line):
+        self.complete = True
       if libsreg.search(line):
         finish_last()
         curdir = None
@@ -393,17 +526,18 @@ class LogParser:
     self.output.start_tools(tier, dirs)
     line = fp.readline()
     while line != "":
-      self.output.build_log(line)
-      if self.errorreg.search(line):
-        return self.error(fp)
-      if self.donereg.search(line):
-        self.complete = True
+      # The next tier's line is logged when the caller parses it
       if self.tierreg.search(line):
         finish_last()
         return line
       if self.toolsreg.search(line):
         finish_last()
         return line
+      self.output.build_log(line)
+      if self.errorreg.search(line):
+        return self.error(fp)
+      if self.donereg.search(line):
+        self.complete = True
       if self.enterreg.search(line):
         match = self.enterreg.search(line)
         dir = match.group(1)
@@ -429,7 +563,9 @@ class LogParser:
       while line != "":
         self.output.build_log(line)
         if self.errorreg.search(line):
-          return self.error(fp)
+          self.error(fp)
+          self.output.destroy()
+          return
         if mainconfig.search(line):
           self.output.start_prebuild()
           lastconfig = "configure"
@@ -468,7 +604,9 @@ class LogParser:
       while line != "":
         self.output.build_log(line)
         if self.errorreg.search(line):
-          return self.error(fp)
+          self.error(fp)
+          self.output.destroy()
+          return
         if self.donereg.search(line):
           self.complete = True
         if self.tierreg.search(line):
@@ -490,4 +628,42 @@ class LogParser:
       self.output.destroy()
       raise
 
-LogParser(ConsoleOutput(sys.stdout)).parse(sys.stdin)
+parser = OptionParser(usage = "%prog [options]")
+parser.add_option("-s", "--status-file", dest = "statusfile", metavar = "FILE",
+                  help = "publish the build state to FILE, read it with status.py")
+parser.add_option("-a", "--archive", dest = "archive", metavar = "FILE",
+                  help = "record the build to a compact archive in FILE")
+parser.add_option("-r", "--replay", dest = "replay", metavar = "FILE",
+                  help = "show the build recorded in the archive FILE rather than reading a log")
+parser.add_option("--summary", action = "store_true", dest = "summary",
+                  help = "print a short summary once the build is done")
+(options, args) = parser.parse_args()
+
+clock = datetime.now
+linecount = None
+if options.replay:
+  try:
+    fp = open(options.replay, "rb")
+  except (IOError, OSError):
+    parser.error("unable to read %s" % options.replay)
+  try:
+    reader = ArchiveReader(fp)
+  except ValueError:
+    parser.error("%s is not a build archive" % options.replay)
+  fp.close()
+  clock = reader.now
+  linecount = reader.line_count
+
+if options.summary:
+  outputs = [SummaryOutput(sys.stdout, clock, linecount)]
+else:
+  outputs = [ConsoleOutput(sys.stdout, clock)]
+if options.statusfile:
+  outputs.append(StatusOutput(options.statusfile, clock))
+if options.archive:
+  outputs.append(ArchiveOutput(options.archive, clock, linecount))
+
+if options.replay:
+  reader.replay(MultiOutput(outputs))
+else:
+  LogParser(MultiOutput(outputs)).parse(sys.stdin)
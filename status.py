@@ -0,0 +1,289 @@
+#! /usr/bin/python
+# ***** BEGIN LICENSE BLOCK *****
+# Version: MPL 1.1/GPL 2.0/LGPL 2.1
+#
+# The contents of this file are subject to the Mozilla Public License Version
+# 1.1 (the "License"); you may not use this file except in compliance with
+# the License. You may obtain a copy of the License at
+# http://www.mozilla.org/MPL/
+#
+# Software distributed under the License is distributed on an "AS IS" basis,
+# WITHOUT WARRANTY OF ANY KIND, either express or implied. See the License
+# for the specific language governing rights and limitations under the
+# License.
+#
+# The Original Code is Mozilla Build Watch.
+#
+# The Initial Developer of the Original Code is
+#   Dave Townsend <dtownsend@oxymoronical.com>
+#
+# Portions created by the Initial Developer are Copyright (C) 2009
+# the Initial Developer. All Rights Reserved.
+#
+# Contributor(s):
+#
+# Alternatively, the contents of this file may be used under the terms of
+# either the GNU General Public License Version 2 or later (the "GPL"), or
+# the GNU Lesser General Public License Version 2.1 or later (the "LGPL"),
+# in which case the provisions of the GPL or the LGPL are applicable instead
+# of those above. If you wish to allow use of your version of this file only
+# under the terms of either the GPL or the LGPL, and not to allow others to
+# use your version of this file under the terms of the MPL, indicate your
+# decision by deleting the provisions above and replace them with the notice
+# and other provisions required by the GPL or the LGPL. If you do not delete
+# the provisions above, a recipient may use your version of this file under
+# the terms of any one of the MPL, the GPL or the LGPL.
+#
+# ***** END LICENSE BLOCK *****
+#
+# Publishes the state of a running build in a small fixed layout file so that
+# shell prompts, tmux status lines and the like can show it cheaply.
+#
+# How to use:
+# - When building:
+#     make -f client.mk 2>&1 build | python /path/to/buildwatch.py -s <statusfile>
+# - From a prompt or status line:
+#     python /path/to/status.py <statusfile>
+#
+# The file is updated in place through mmap. A writer makes the sequence
+# number odd before changing anything and even again once it is done, so a
+# reader that sees an odd or changing sequence number simply tries again.
+
+import os, sys, struct, mmap, time
+from datetime import datetime
+from util import to_bytes, from_bytes, timestamp, format_duration
+
+MAGIC = b"BWST"
+VERSION = 1
+
+# Layout: magic, version, phase, failed flag, padding, sequence number,
+# position, total, start time, elapsed seconds, tier name, directory name.
+# The file is only written when the build state changes, so while a build is
+# running readers should measure the elapsed time from the start time. The
+# stored elapsed time is only final once the build has completed or failed.
+LAYOUT = struct.Struct("<4sBBBxIIIdd32s64s")
+SIZE = LAYOUT.size
+SEQ_OFFSET = 8
+
+# How many times a reader looks for a stable state before giving up
+RETRIES = 5
+
+IDLE = 0
+PREBUILD = 1
+EXPORT = 2
+LIBS = 3
+TOOLS = 4
+COMPLETE = 5
+
+PHASES = ["idle", "prebuild", "export", "libs", "tools", "complete"]
+
+# The StatusFile owns the mapped file and writes complete states into it.
+class StatusFile:
+  map = None
+  seq = 0
+
+  def __init__(self, path):
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+      os.ftruncate(fd, SIZE)
+      self.map = mmap.mmap(fd, SIZE)
+    finally:
+      os.close(fd)
+
+  def write(self, phase, failed, pos, total, start, elapsed, tier, dir):
+    # Mark the record as in flux while it is rewritten. Always start from an
+    # even number so an earlier interrupted write cannot flip the parity.
+    base = self.seq - self.seq % 2
+    self.seq = base + 1
+    struct.pack_into("<I", self.map, SEQ_OFFSET, self.seq)
+    LAYOUT.pack_into(self.map, 0, MAGIC, VERSION, phase, failed and 1 or 0,
+                     self.seq, pos, total, start, elapsed,
+                     to_bytes(tier)[:32], to_bytes(dir)[:64])
+    self.seq = base + 2
+    struct.pack_into("<I", self.map, SEQ_OFFSET, self.seq)
+
+  def close(self):
+    self.map.close()
+
+# The StatusOutput receives signals during the build process and publishes
+# them to a StatusFile.
+class StatusOutput:
+  status = None
+  clock = None
+  start = None
+  phase = IDLE
+  failed = False
+  tier = ""
+  dir = ""
+  dirs = None
+  pos = 0
+
+  def __init__(self, path, clock = datetime.now):
+    self.status = StatusFile(path)
+    self.clock = clock
+    self.start = timestamp(self.clock())
+    self._update()
+
+  def _update(self):
+    elapsed = timestamp(self.clock()) - self.start
+    total = 0
+    if self.dirs:
+      total = len(self.dirs)
+    self.status.write(self.phase, self.failed, self.pos, total, self.start,
+                      elapsed, self.tier, self.dir)
+
+  def _start_dir(self, phase, dir):
+    self.phase = phase
+    self.dir = dir
+    self.pos = self.dirs.index(dir) + 1
+    self._update()
+
+  def destroy(self):
+    if not self.failed:
+      self.phase = COMPLETE
+    self._update()
+    self.status.close()
+
+  def start_prebuild(self):
+    self.phase = PREBUILD
+    self._update()
+
+  def start_configure(self, name):
+    self.phase = PREBUILD
+    self.tier = "prebuild"
+    self.dir = name
+    self._update()
+
+  def finish_configure(self, name):
+    pass
+
+  def start_tier(self, name, dirs):
+    self.phase = EXPORT
+    self.tier = name
+    self.dirs = dirs
+    self.dir = ""
+    self.pos = 0
+    self._update()
+
+  def start_exports(self, dir):
+    self._start_dir(EXPORT, dir)
+
+  def start_export_subdir(self, dir):
+    pass
+
+  def finish_exports(self, dir):
+    pass
+
+  def start_libs(self, dir):
+    self._start_dir(LIBS, dir)
+
+  def start_libs_subdir(self, dir):
+    pass
+
+  def finish_libs(self, dir):
+    pass
+
+  def start_tools(self, name, dirs):
+    self.phase = TOOLS
+    self.tier = name
+    self.dirs = dirs
+    self.dir = ""
+    self.pos = 0
+    self._update()
+
+  def start_tools_dir(self, dir):
+    self._start_dir(TOOLS, dir)
+
+  def start_tools_subdir(self, dir):
+    pass
+
+  def finish_tools_dir(self, dir):
+    pass
+
+  def error(self):
+    if self.failed:
+      return
+    self.failed = True
+    self._update()
+
+  def build_log(self, line):
+    pass
+
+# Reads a consistent snapshot of a status file. Returns None if the file
+# does not hold a status or no stable state could be read.
+def read_status(path):
+  fp = open(path, "rb")
+  try:
+    if os.fstat(fp.fileno()).st_size < SIZE:
+      return None
+    map = mmap.mmap(fp.fileno(), SIZE, access = mmap.ACCESS_READ)
+  finally:
+    fp.close()
+  try:
+    if map[:len(MAGIC) + 1] != MAGIC + struct.pack("<B", VERSION):
+      return None
+    for attempt in range(RETRIES):
+      seq = struct.unpack_from("<I", map, SEQ_OFFSET)[0]
+      values = LAYOUT.unpack_from(map, 0)
+      if seq % 2 == 0 and struct.unpack_from("<I", map, SEQ_OFFSET)[0] == seq:
+        break
+      time.sleep(0.001)
+    else:
+      return None
+  finally:
+    map.close()
+
+  magic, version, phase, failed, influx, pos, total, start, elapsed, tier, dir = values
+  if magic != MAGIC or version != VERSION or phase >= len(PHASES):
+    return None
+  return {
+    "phase": PHASES[phase],
+    "failed": failed != 0,
+    "sequence": seq,
+    "position": pos,
+    "total": total,
+    "start": start,
+    "elapsed": elapsed,
+    "tier": from_bytes(tier.rstrip(b"\0")),
+    "dir": from_bytes(dir.rstrip(b"\0")),
+  }
+
+# Formats a status in the short form used for prompts, e.g. "gecko libs 143/310"
+def format_status(status):
+  if status["phase"] in ("export", "libs", "tools") and status["total"] > 0:
+    text = "%s %s %d/%d" % (status["tier"], status["phase"], status["position"], status["total"])
+  elif status["phase"] == "prebuild":
+    text = "prebuild %s" % status["dir"]
+  else:
+    text = status["phase"]
+  if status["failed"]:
+    text += " failed"
+  return text
+
+# Returns the elapsed time of a status, still counting if the build is running
+def elapsed_time(status):
+  if status["phase"] == "complete" or status["failed"]:
+    return status["elapsed"]
+  return max(time.time() - status["start"], 0)
+
+if __name__ == "__main__":
+  from optparse import OptionParser
+
+  parser = OptionParser(usage = "%prog [options] <statusfile>")
+  parser.add_option("-e", "--elapsed", action = "store_true", dest = "elapsed",
+                    help = "include the elapsed build time")
+  (options, args) = parser.parse_args()
+  if len(args) != 1:
+    parser.error("expected a single status file")
+
+  try:
+    status = read_status(args[0])
+  except (IOError, OSError):
+    status = None
+  if status is None:
+    sys.exit(1)
+
+  text = format_status(status)
+  if options.elapsed:
+    text += " %s" % format_duration(elapsed_time(status))
+  sys.stdout.write(text + "\n")
@@ -0,0 +1,64 @@
+# ***** BEGIN LICENSE BLOCK *****
+# Version: MPL 1.1/GPL 2.0/LGPL 2.1
+#
+# The contents of this file are subject to the Mozilla Public License Version
+# 1.1 (the "License"); you may not use this file except in compliance with
+# the License. You may obtain a copy of the License at
+# http://www.mozilla.org/MPL/
+#
+# Software distributed under the License is distributed on an "AS IS" basis,
+# WITHOUT WARRANTY OF ANY KIND, either express or implied. See the License
+# for the specific language governing rights and limitations under the
+# License.
+#
+# The Original Code is Mozilla Build Watch.
+#
+# The Initial Developer of the Original Code is
+#   Dave Townsend <dtownsend@oxymoronical.com>
+#
+# Portions created by the Initial Developer are Copyright (C) 2009
+# the Initial Developer. All Rights Reserved.
+#
+# Contributor(s):
+#
+# Alternatively, the contents of this file may be used under the terms of
+# either the GNU General Public License Version 2 or later (the "GPL"), or
+# the GNU Lesser General Public License Version 2.1 or later (the "LGPL"),
+# in which case the provisions of the GPL or the LGPL are applicable instead
+# of those above. If you wish to allow use of your version of this file only
+# under the terms of either the GPL or the LGPL, and not to allow others to
+# use your version of this file under the terms of the MPL, indicate your
+# decision by deleting the provisions above and replace them with the notice
+# and other provisions required by the GPL or the LGPL. If you do not delete
+# the provisions above, a recipient may use your version of this file under
+# the terms of any one of the MPL, the GPL or the LGPL.
+#
+# ***** END LICENSE BLOCK *****
+#
+#
+# Small helpers shared by the outputs.
+
+import time
+
+# Converts text to utf-8 bytes, leaving bytes alone
+def to_bytes(text):
+  if isinstance(text, bytes):
+    return text
+  return text.encode("utf-8", "replace")
+
+# Converts utf-8 bytes to the native string type
+def from_bytes(data):
+  data = bytes(data)
+  if str is bytes:
+    return data
+  return data.decode("utf-8", "replace")
+
+# Converts a datetime to seconds since the epoch
+def timestamp(date):
+  return time.mktime(date.timetuple()) + date.microsecond / 1000000.0
+
+# Formats a number of seconds as h:mm:ss
+def format_duration(seconds):
+  delta, seconds = divmod(int(seconds), 60)
+  hours, minutes = divmod(delta, 60)
+  return "%d:%02d:%02d" % (hours, minutes, seconds)